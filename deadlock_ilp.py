@@ -1,18 +1,104 @@
 # deadlock_ilp.py
 import time
-from typing import Callable, Optional, Tuple
+from typing import Callable, Dict, Iterable, List, Optional, Set, Tuple
+import numpy as np
 import pulp  # đảm bảo đã: python -m pip install pulp
 
-from petri import PetriNet
+try:
+    # HiGHS chạy in-process: giữ model/solver giữa các vòng lặp, không spawn CBC
+    import highspy
+except ImportError:  # không có highspy -> dùng PULP_CBC_CMD
+    highspy = None
+
+try:
+    # Gurobi: kiểm tra reachability bằng lazy constraint trong một cây B&B duy nhất
+    import gurobipy as gp
+    from gurobipy import GRB
+except ImportError:
+    gp = None
+
+from petri import PetriNet, set_bit_indices
 from reachability import fmt_marking
 
 
-def build_deadlock_ilp_model(net: PetriNet):
+def _marking_from_values(values) -> int:
+    """Dựng marking M (bitmask) từ nghiệm x_i: bit i = 1 nếu x_i > 0.5.
+    Vector hóa bằng np.packbits (little-endian), đúng với mọi số places."""
+    bits = np.asarray(values, dtype=np.float64) > 0.5
+    return int.from_bytes(np.packbits(bits, bitorder="little").tobytes(), "little")
+
+
+def _exclusive_cliques(
+    exclusive_pairs: Iterable[Tuple[int, int]], max_cliques: int
+) -> List[List[int]]:
+    """
+    Gộp các cặp loại trừ (i, j) thành clique: mọi cặp place trong clique đều
+    loại trừ nhau => một hàng sum_{i in clique} x_i <= 1 thay cho nhiều hàng
+    x_i + x_j <= 1 (VD chuỗi n places: 1 hàng thay vì n(n-1)/2 hàng).
+    Phủ tham lam: mỗi cặp chưa được phủ mở rộng thành một clique cực đại.
+    Tối đa max_cliques clique; các cặp còn lại bị bỏ (chỉ là điều kiện cần).
+    """
+    adj: Dict[int, Set[int]] = {}
+    for i, j in exclusive_pairs:
+        adj.setdefault(i, set()).add(j)
+        adj.setdefault(j, set()).add(i)
+
+    covered: Set[Tuple[int, int]] = set()
+    cliques = []
+    for i in sorted(adj):
+        for j in sorted(adj[i]):
+            if j < i or (i, j) in covered:
+                continue
+            if len(cliques) >= max_cliques:
+                return cliques
+            clique = [i, j]
+            candidates = adj[i] & adj[j]
+            while candidates:
+                k = min(candidates)
+                clique.append(k)
+                candidates &= adj[k]
+            clique.sort()
+            for a, u in enumerate(clique):
+                for v in clique[a + 1:]:
+                    covered.add((u, v))
+            cliques.append(clique)
+    return cliques
+
+
+def _reach_invariant_rows(
+    cardinality: Optional[Tuple[int, int]],
+    exclusive_pairs: Optional[Iterable[Tuple[int, int]]],
+    num_places: int,
+) -> List[Tuple[int, int, List[int]]]:
+    """
+    Điều kiện cần cho mọi marking reachable (nên cho mọi dead marking reachable),
+    dạng hàng thưa (lower, upper, indices) với hệ số 1:
+      - cardinality = (min_ones, max_ones): min_ones <= sum_i x_i <= max_ones
+      - exclusive_pairs: (i, j) không bao giờ cùng có token, gộp thành clique
+        (xem _exclusive_cliques) => sum_{i in clique} x_i <= 1, tối đa num_places hàng
+    Các ràng buộc này loại trước nhiều marking không reachable, giảm số blocking cut.
+    """
+    rows = []
+    if cardinality is not None:
+        min_ones, max_ones = cardinality
+        rows.append((min_ones, max_ones, list(range(num_places))))
+    for clique in _exclusive_cliques(exclusive_pairs or (), num_places):
+        rows.append((0, 1, clique))
+    return rows
+
+
+def build_deadlock_ilp_model(
+    net: PetriNet,
+    cardinality: Optional[Tuple[int, int]] = None,
+    exclusive_pairs: Optional[Iterable[Tuple[int, int]]] = None,
+):
     """
     Tạo ILP model cho dead marking:
       - Biến x_i ∈ {0,1} cho mỗi place i
-      - Ràng buộc: với mỗi transition t, sum_{p in preset(t)} (1 - x_p) >= 1
+      - Ràng buộc: với mỗi transition t, sum_{p in preset(t)} x_p <= |preset(t)| - 1
         => không transition nào enabled
+      - (Tùy chọn) ràng buộc cardinality / exclusive_pairs của Reach(M0),
+        xem _reach_invariant_rows
     Trả về: (model, dict x)
     """
     num_places = len(net.places)
@@ -30,30 +116,259 @@ def build_deadlock_ilp_model(net: PetriNet):
     # Ràng buộc dead-marking: không transition nào enabled
     for t in net.transitions:
         # preset(t): các place có bit = 1 trong pre_mask
-        preset_indices = [
-            i for i in range(num_places) if (t.pre_mask >> i) & 1
-        ]
-
+        tid, preset_indices = t.id, t.pre_indices
         if preset_indices:
-            # sum_{p in preset(t)} (1 - x_p) >= 1
+            # sum_{p in preset(t)} x_p <= |preset(t)| - 1
+            # (tương đương sum (1 - x_p) >= 1, nhưng ít term hơn và không có hằng số)
             # => Ít nhất 1 input place KHÔNG có token => t không enabled
-            model += (
-                pulp.lpSum(1 - x[i] for i in preset_indices) >= 1,
-                f"dead_t_{t.id}",
+            expr = pulp.LpAffineExpression([(x[i], 1) for i in preset_indices])
+            model.addConstraint(
+                pulp.LpConstraint(
+                    expr,
+                    sense=pulp.LpConstraintLE,
+                    rhs=len(preset_indices) - 1,
+                ),
+                name=f"dead_t_{tid}",
             )
         else:
             # preset rỗng → t luôn enabled → không thể có dead marking
             # Thêm constraint 0 >= 1 để model luôn UNSAT nếu có transition như vậy
-            model += 0 >= 1, f"no_deadlock_due_to_{t.id}"
+            model += 0 >= 1, f"no_deadlock_due_to_{tid}"
+
+    # Điều kiện cần suy ra từ tập reachable (BDD/BFS)
+    for k, (lower, upper, indices) in enumerate(
+        _reach_invariant_rows(cardinality, exclusive_pairs, num_places)
+    ):
+        expr = pulp.LpAffineExpression([(x[i], 1) for i in indices])
+        model.addConstraint(
+            pulp.LpConstraint(expr, sense=pulp.LpConstraintLE, rhs=upper),
+            name=f"reach_ub_{k}",
+        )
+        if lower > 0:
+            model.addConstraint(
+                pulp.LpConstraint(expr, sense=pulp.LpConstraintGE, rhs=lower),
+                name=f"reach_lb_{k}",
+            )
 
     return model, x
 
 
+def build_deadlock_highs_model(
+    net: PetriNet,
+    time_limit: Optional[int] = None,
+    cardinality: Optional[Tuple[int, int]] = None,
+    exclusive_pairs: Optional[Iterable[Tuple[int, int]]] = None,
+):
+    """
+    Tạo cùng ILP model dead marking như build_deadlock_ilp_model nhưng trực tiếp
+    trên HiGHS (highspy) bằng addVars/addRow với ma trận thưa.
+    Trả về: Highs instance, hoặc None nếu có transition preset rỗng (không thể deadlock).
+    """
+    num_places = len(net.places)
+
+    h = highspy.Highs()
+    h.setOptionValue("output_flag", False)
+    if time_limit is not None:
+        h.setOptionValue("time_limit", float(time_limit))
+
+    # Biến nhị phân x_i cho từng place (objective = 0)
+    h.addVars(num_places, np.zeros(num_places), np.ones(num_places))
+    h.changeColsIntegrality(
+        num_places,
+        np.arange(num_places, dtype=np.int32),
+        np.array([highspy.HighsVarType.kInteger] * num_places),
+    )
+
+    inf = highspy.kHighsInf
+    for t in net.transitions:
+        preset_indices = t.pre_indices
+        if not preset_indices:
+            # preset rỗng → t luôn enabled → không thể có dead marking
+            return None
+        # sum_{p in preset(t)} x_p <= |preset(t)| - 1
+        h.addRow(
+            -inf,
+            len(preset_indices) - 1,
+            len(preset_indices),
+            np.array(preset_indices, dtype=np.int32),
+            np.ones(len(preset_indices)),
+        )
+
+    # Điều kiện cần suy ra từ tập reachable (BDD/BFS)
+    for lower, upper, indices in _reach_invariant_rows(cardinality, exclusive_pairs, num_places):
+        h.addRow(
+            lower,
+            upper,
+            len(indices),
+            np.array(indices, dtype=np.int32),
+            np.ones(len(indices)),
+        )
+
+    return h
+
+
+def _report_dead_marking(net: PetriNet, M: int, elapsed: float) -> None:
+    print("[INFO] Found reachable dead marking!")
+    print("  Bitmap  :", format(M, f"0{len(net.places)}b"))
+    print("  Marking :", fmt_marking(M, net.places))
+    print("  Time    :", elapsed, "seconds")
+
+
+def _find_deadlock_with_highs(
+    net: PetriNet,
+    is_reachable: Callable[[int], bool],
+    time_limit: Optional[int],
+    max_iter: int,
+    cardinality: Optional[Tuple[int, int]],
+    exclusive_pairs: Optional[Iterable[Tuple[int, int]]],
+) -> Tuple[Optional[int], float]:
+    """Vòng lặp cutting-plane trên một Highs instance duy nhất (xem find_deadlock_with_ilp)."""
+    num_places = len(net.places)
+    start = time.perf_counter()
+
+    h = build_deadlock_highs_model(net, time_limit, cardinality, exclusive_pairs)
+    if h is None:
+        elapsed = time.perf_counter() - start
+        print("[INFO] ILP status = Infeasible -> không tìm thấy dead marking nào.")
+        return None, elapsed
+
+    all_cols = np.arange(num_places, dtype=np.int32)
+    iteration = 0
+
+    while True:
+        iteration += 1
+        if iteration > max_iter:
+            elapsed = time.perf_counter() - start
+            print(f"[WARN] Vượt quá {max_iter} vòng lặp ILP, dừng.")
+            return None, elapsed
+
+        # Solve lại cùng Highs instance: không fork/exec, không ghi file LP
+        h.run()
+        status = h.getModelStatus()
+
+        if status != highspy.HighsModelStatus.kOptimal:
+            elapsed = time.perf_counter() - start
+            print(
+                f"[INFO] ILP status = {h.modelStatusToString(status)} "
+                "-> không tìm thấy dead marking nào."
+            )
+            return None, elapsed
+
+        # Đọc nghiệm x_i để dựng marking M (bitmask)
+        M = _marking_from_values(h.getSolution().col_value)
+
+        # Kiểm tra reachable bằng BDD hoặc BFS (tùy is_reachable)
+        if is_reachable(M):
+            elapsed = time.perf_counter() - start
+            _report_dead_marking(net, M, elapsed)
+            return M, elapsed
+
+        # Blocking constraint (như bản PuLP), chuyển hằng số sang vế phải:
+        #   sum_{i: bit=1} x_i - sum_{i: bit=0} x_i <= popcount(M) - 1
+        ones = set_bit_indices(M)
+        coefs = np.full(num_places, -1.0)
+        coefs[ones] = 1.0
+        h.addRow(-highspy.kHighsInf, len(ones) - 1, num_places, all_cols, coefs)
+
+
+def _find_deadlock_with_gurobi(
+    net: PetriNet,
+    is_reachable: Callable[[int], bool],
+    time_limit: Optional[int],
+    max_iter: int,
+    cardinality: Optional[Tuple[int, int]],
+    exclusive_pairs: Optional[Iterable[Tuple[int, int]]],
+) -> Tuple[Optional[int], float]:
+    """
+    Một lần optimize duy nhất với lazy-constraint callback (xem find_deadlock_with_ilp):
+    mỗi nghiệm MIPSOL được kiểm tra bằng is_reachable, nếu không reachable thì
+    bị loại bằng cbLazy thay vì giải lại toàn bộ MIP.
+    """
+    num_places = len(net.places)
+    start = time.perf_counter()
+
+    if any(not t.pre_indices for t in net.transitions):
+        # preset rỗng → t luôn enabled → không thể có dead marking
+        elapsed = time.perf_counter() - start
+        print("[INFO] ILP status = Infeasible -> không tìm thấy dead marking nào.")
+        return None, elapsed
+
+    found: List[int] = []
+    rejected = 0
+
+    with gp.Env(empty=True) as env:
+        env.setParam("OutputFlag", 0)
+        env.start()
+        with gp.Model("DeadlockDetection", env=env) as model:
+            x = [model.addVar(vtype=GRB.BINARY, name=f"x_{i}") for i in range(num_places)]
+            for t in net.transitions:
+                # sum_{p in preset(t)} x_p <= |preset(t)| - 1
+                model.addConstr(
+                    gp.quicksum(x[i] for i in t.pre_indices) <= len(t.pre_indices) - 1,
+                    name=f"dead_t_{t.id}",
+                )
+
+            # Điều kiện cần suy ra từ tập reachable (BDD/BFS)
+            for lower, upper, indices in _reach_invariant_rows(
+                cardinality, exclusive_pairs, num_places
+            ):
+                expr = gp.quicksum(x[i] for i in indices)
+                model.addConstr(expr <= upper)
+                if lower > 0:
+                    model.addConstr(expr >= lower)
+
+            model.Params.LazyConstraints = 1
+            if time_limit is not None:
+                model.Params.TimeLimit = time_limit
+
+            def callback(m, where):
+                nonlocal rejected
+                if where != GRB.Callback.MIPSOL:
+                    return
+
+                M = _marking_from_values(m.cbGetSolution(x))
+
+                if is_reachable(M):
+                    found.append(M)
+                    m.terminate()
+                    return
+
+                rejected += 1
+                if rejected > max_iter:
+                    m.terminate()
+                    return
+
+                # Blocking constraint như bản PuLP, thêm dưới dạng lazy constraint:
+                #   sum_{i: bit=1} x_i - sum_{i: bit=0} x_i <= popcount(M) - 1
+                ones = set_bit_indices(M)
+                coefs = [-1.0] * num_places
+                for i in ones:
+                    coefs[i] = 1.0
+                m.cbLazy(gp.LinExpr(coefs, x) <= len(ones) - 1)
+
+            model.optimize(callback)
+            status = model.Status
+
+    elapsed = time.perf_counter() - start
+    if found:
+        _report_dead_marking(net, found[0], elapsed)
+        return found[0], elapsed
+    if rejected > max_iter:
+        print(f"[WARN] Vượt quá {max_iter} vòng lặp ILP, dừng.")
+        return None, elapsed
+
+    status_str = "Infeasible" if status == GRB.INFEASIBLE else f"Gurobi status {status}"
+    print(f"[INFO] ILP status = {status_str} -> không tìm thấy dead marking nào.")
+    return None, elapsed
+
+
 def find_deadlock_with_ilp(
     net: PetriNet,
     is_reachable: Callable[[int], bool],
     time_limit: Optional[int] = None,
     max_iter: int = 1000,
+    cardinality: Optional[Tuple[int, int]] = None,
+    exclusive_pairs: Optional[Iterable[Tuple[int, int]]] = None,
 ) -> Tuple[Optional[int], float]:
     """
     Tìm một deadlock (dead marking reachable) bằng ILP + BDD/Reachability.
@@ -65,18 +380,50 @@ def find_deadlock_with_ilp(
                       - Hiện tại có thể dùng: lambda M: M in visited (BFS).
         time_limit: giới hạn thời gian cho mỗi lần solve ILP (giây) – có thể None.
         max_iter: số lần lặp tối đa (đề phòng lỗi logic).
+        cardinality: (min_ones, max_ones) số token của mọi marking reachable – có thể None.
+        exclusive_pairs: các cặp place (i, j) không bao giờ cùng có token trong
+                         marking reachable – có thể None.
+                         Cả hai là điều kiện cần, được thêm vào ILP một lần trước
+                         vòng lặp để giảm số blocking constraint.
 
     Returns:
         (dead_marking, elapsed_time)
         - dead_marking: int (bitmask) nếu tìm được, hoặc None nếu không có deadlock reachable.
         - elapsed_time: thời gian chạy (giây).
+
+    Thứ tự backend:
+      - gurobipy: một lần optimize với lazy-constraint callback
+        (GurobiError, VD license giới hạn kích thước -> dùng backend tiếp theo),
+      - highspy: HiGHS in-process (giữ solver giữa các vòng lặp),
+      - ngược lại: PULP_CBC_CMD.
     """
+    if gp is not None:
+        try:
+            return _find_deadlock_with_gurobi(
+                net, is_reachable, time_limit, max_iter, cardinality, exclusive_pairs
+            )
+        except gp.GurobiError as exc:
+            # VD: license giới hạn kích thước (pip install gurobipy) -> model quá lớn
+            print(f"[WARN] Gurobi lỗi ({exc}), chuyển sang HiGHS/CBC.")
+    if highspy is not None:
+        return _find_deadlock_with_highs(
+            net, is_reachable, time_limit, max_iter, cardinality, exclusive_pairs
+        )
+
     num_places = len(net.places)
-    model, x = build_deadlock_ilp_model(net)
+    model, x = build_deadlock_ilp_model(net, cardinality, exclusive_pairs)
+    # Hệ số mặc định (-1) cho mọi x_i trong blocking constraint
+    block_base = {x[i]: -1 for i in range(num_places)}
 
     start = time.perf_counter()
     iteration = 0
 
+    # Chọn solver CBC mặc định của PuLP (tạo một lần, dùng lại cho mọi vòng lặp)
+    if time_limit is not None:
+        solver = pulp.PULP_CBC_CMD(msg=False, timeLimit=time_limit)
+    else:
+        solver = pulp.PULP_CBC_CMD(msg=False)
+
     while True:
         iteration += 1
         if iteration > max_iter:
@@ -84,12 +431,6 @@ def find_deadlock_with_ilp(
             print(f"[WARN] Vượt quá {max_iter} vòng lặp ILP, dừng.")
             return None, elapsed
 
-        # Chọn solver CBC mặc định của PuLP
-        if time_limit is not None:
-            solver = pulp.PULP_CBC_CMD(msg=False, timeLimit=time_limit)
-        else:
-            solver = pulp.PULP_CBC_CMD(msg=False)
-
         model.solve(solver)
         status_str = pulp.LpStatus.get(model.status, "Unknown")
 
@@ -100,32 +441,35 @@ def find_deadlock_with_ilp(
             return None, elapsed
 
         # Đọc nghiệm x_i để dựng marking M (bitmask)
-        M = 0
-        for i in range(num_places):
-            val = x[i].varValue
-            bit = 1 if val is not None and val > 0.5 else 0
-            if bit == 1:
-                M |= (1 << i)
+        vals = np.fromiter(
+            (x[i].varValue or 0.0 for i in range(num_places)),
+            dtype=np.float64,
+            count=num_places,
+        )
+        M = _marking_from_values(vals)
 
         # Kiểm tra reachable bằng BDD hoặc BFS (tùy is_reachable)
         if is_reachable(M):
             elapsed = time.perf_counter() - start
-            print("[INFO] Found reachable dead marking!")
-            print("  Bitmap  :", format(M, f"0{num_places}b"))
-            print("  Marking :", fmt_marking(M, net.places))
-            print("  Time    :", elapsed, "seconds")
+            _report_dead_marking(net, M, elapsed)
             return M, elapsed
 
         # Nếu M không reachable:
         # Thêm constraint blocking để cấm lại đúng marking này:
         #   sum_{i: bit=1} x_i + sum_{i: bit=0} (1 - x_i) <= num_places - 1
+        # <=> sum_{i: bit=1} x_i - sum_{i: bit=0} x_i <= popcount(M) - 1
         # => Ít nhất 1 bit phải khác đi
-        block_constraint = (
-            pulp.lpSum(
-                x[i] if ((M >> i) & 1) == 1 else (1 - x[i])
-                for i in range(num_places)
-            )
-            <= num_places - 1
+        # Chỉ duyệt các bit đã set của M; các bit 0 lấy hệ số -1 từ block_base
+        ones = set_bit_indices(M)
+        coefs = dict(block_base)
+        for i in ones:
+            coefs[x[i]] = 1
+        model.addConstraint(
+            pulp.LpConstraint(
+                pulp.LpAffineExpression(coefs),
+                sense=pulp.LpConstraintLE,
+                rhs=len(ones) - 1,
+            ),
+            name=f"block_{iteration}",
         )
-        model += block_constraint, f"block_{iteration}"
         # quay lại vòng while, solve với constraint mới
\ No newline at end of file
@@ -4,11 +4,20 @@ import time
 import random
 
 from petri import parse_pnml
-from reachability import bfs_reachability, fmt_marking, marking_to_bitmap
+from reachability import bfs_reachability, fmt_marking, marking_to_bitmap, reachable_invariants
 from deadlock_ilp import find_deadlock_with_ilp              # Task 4 (ILP)
-from symbolic_bdd import build_reachability_bdd, is_marking_reachable_bdd  # Task 3 (BDD)
+from symbolic_bdd import (  # Task 3 (BDD)
+    build_reachability_bdd,
+    is_marking_reachable_bdd,
+    reachable_invariants_bdd,
+)
 # Import task 5
-from optimization import find_optimal_marking, complete_and_optimize_marking
+from optimization import find_optimal_marking
+
+# Chỉ chạy --deadlock: nếu BFS đã liệt kê ít hơn ngần này markings thì dùng
+# tập visited làm oracle reachability, không cần xây BDD
+BFS_ORACLE_MAX_STATES = 1 << 20
+
 def main():
     ap = argparse.ArgumentParser(allow_abbrev=False)
     ap.add_argument("--pnml", required=True, help="Name of file PNML")
@@ -52,10 +61,18 @@ def main():
                 f"{fmt_marking(M, net.places)} -{t}-> {fmt_marking(M2, net.places)}"
             )
 
+    # Task 4 chỉ cần oracle reachability: với net nhỏ, tập visited của BFS là đủ (O(1))
+    use_bfs_oracle = (
+        args.deadlock
+        and not args.symbolic
+        and not args.optimize
+        and len(visited) < BFS_ORACLE_MAX_STATES
+    )
+
     # ===== Task 3: Symbolic reachability bằng BDD 
     bdd = R = curr_vars = None
-    # Task 3 cần chạy nếu user yêu cầu symbolic, deadlock HOẶC optimize
-    if args.symbolic or args.deadlock or args.optimize:
+    # Task 3 cần chạy nếu user yêu cầu symbolic, optimize HOẶC deadlock (khi không dùng BFS)
+    if args.symbolic or args.optimize or (args.deadlock and not use_bfs_oracle):
         print("\n[INFO] Building symbolic reachability BDD (Task 3)...")
         t0 = time.perf_counter()
         bdd, R, curr_vars = build_reachability_bdd(net)
@@ -69,10 +86,25 @@ def main():
     if args.deadlock:
         print("\n[INFO] Running ILP-based deadlock detection (Task 4)...")
 
-        def is_reachable_marking(M: int) -> bool:
-            return is_marking_reachable_bdd(M, bdd, R, curr_vars)
+        if use_bfs_oracle:
+            print("[INFO] Using explicit BFS markings as reachability oracle (BDD skipped).")
+            is_reachable_marking = visited.__contains__
+            cardinality, exclusive_pairs = reachable_invariants(visited, len(net.places))
+        else:
+            # Không cần cache: mỗi M bị loại đều có blocking cut nên ILP không đề xuất lại
+            def is_reachable_marking(M: int) -> bool:
+                return is_marking_reachable_bdd(M, bdd, R, curr_vars)
+
+            cardinality, exclusive_pairs = reachable_invariants_bdd(bdd, R, curr_vars)
 
-        dead_M, elapsed = find_deadlock_with_ilp(net, is_reachable_marking)
+        # Điều kiện cần của marking reachable (số token min/max, cặp place loại trừ)
+        # được thêm vào ILP một lần, giảm số vòng lặp blocking
+        dead_M, elapsed = find_deadlock_with_ilp(
+            net,
+            is_reachable_marking,
+            cardinality=cardinality,
+            exclusive_pairs=exclusive_pairs,
+        )
 
         if dead_M is None:
             print("[RESULT] No reachable deadlock found.")
@@ -85,7 +117,8 @@ def main():
                 "[RESULT] Deadlock marking (places):",
                 fmt_marking(dead_M, net.places),
             )
-            print(f"[RESULT] ILP + BDD time: {elapsed:.6f} seconds")
+            oracle = "BFS" if use_bfs_oracle else "BDD"
+            print(f"[RESULT] ILP + {oracle} time: {elapsed:.6f} seconds")
 
    # ==== Task 5: Optimization over Reachable Markings ====
     if args.optimize:
@@ -103,24 +136,20 @@ def main():
         # 2. Gọi hàm tối ưu trên BDD
         t_opt_start = time.perf_counter()
         
-        # Tìm đường đi lớn nhất trên các node ĐÃ XUẤT HIỆN trong BDD
-        # Lưu ý: Hàm này trả về score dựa trên các biến có mặt trong path
-        base_max_val, partial_marking = find_optimal_marking(R, weights)
-        
-        # 3. Tối ưu hóa các biến "Don't care" (không xuất hiện trong path BDD)
-        if base_max_val == float('-inf'):
+        # Tính sẵn trọng số và tên place gốc theo tên biến BDD (curr_vars trùng thứ tự places)
+        w_by_var = {curr: weights.get(p, 0) for curr, p in zip(curr_vars, net.places)}
+        orig_name = dict(zip(curr_vars, net.places))
+
+        # Tìm đường đi lớn nhất trên BDD; các biến "Don't care" (không xuất hiện
+        # trong path BDD) được tối ưu ngay trong cùng một lượt
+        final_total_score, final_marking_dict = find_optimal_marking(R, w_by_var, orig_name)
+
+        if final_total_score == float('-inf'):
             print("[RESULT] No reachable marking found.")
         else:
-            final_marking_dict, extra_score = complete_and_optimize_marking(
-                partial_marking, net.places, weights
-            )
-            
-            # Tổng điểm thực tế = Điểm trên path + Điểm từ các biến Don't care dương
-            final_total_score = base_max_val + extra_score
-            
             t_opt_end = time.perf_counter()
 
-            # 4. Xuất kết quả
+            # 3. Xuất kết quả
             print(f"[RESULT] Found Optimal Marking!")
             print(f"  Max Objective Value: {final_total_score}")
             
@@ -1,86 +1,143 @@
 # optimization.py
 import re
 
+# Pattern tên biến BDD: v[số]_[tên_gốc]
+_PAT = re.compile(r"v\d+_(.+)")
+
 def get_original_name(bdd_var_name):
-    # Regex tìm pattern: v[số]_[tên_gốc]
-    match = re.match(r"v\d+_(.+)", bdd_var_name)
+    # Fallback khi không có bảng orig_name: tách tên gốc bằng regex
+    match = _PAT.match(bdd_var_name)
     if match:
         return match.group(1)
     return bdd_var_name
 
-def find_optimal_marking(bdd_node, weights, memo=None):
-    """
-    Tìm marking tối ưu trên cây BDD (Max Weight Path).
-    """
-    if memo is None:
-        memo = {}
-
-    # 1. Base Cases: Kiểm tra node terminal (True/False)
-    # Thư viện dd: node False là 0, node True là 1
-    # Lưu ý: so sánh (bdd_node == 1) đôi khi an toàn hơn int(bdd_node) tùy phiên bản
-    if bdd_node == 0: 
-        return float('-inf'), {} # Dead end
-    if bdd_node == 1:
-        return 0, {} # Đích đến
-
-    # 2. Check Cache
-    # Với thư viện dd, ta dùng str(bdd_node) hoặc id(bdd_node) làm key
-    node_id = id(bdd_node)
-    if node_id in memo:
-        return memo[node_id]
-
-    # 3. Lấy thông tin biến và trọng số
-    bdd_var = str(bdd_node.var) # VD: 'v0_p1'
-    original_place_name = get_original_name(bdd_var) # VD: 'p1'
-    
-    # Lấy trọng số, nếu không tìm thấy thì mặc định là 0
-    w = weights.get(original_place_name, 0)
-
-    # 4. Đệ quy
-    # Nhánh Low (Place = 0): Không cộng trọng số
-    score_low, path_low = find_optimal_marking(bdd_node.low, weights, memo)
-    
-    # Nhánh High (Place = 1): CỘNG trọng số
-    score_high, path_high = find_optimal_marking(bdd_node.high, weights, memo)
-    
-    if score_high != float('-inf'):
-        score_high += w
-
-    # 5. So sánh
-    if score_high >= score_low:
-        best_score = score_high
-        best_path = path_high.copy()
-        best_path[original_place_name] = 1
-    else:
-        best_score = score_low
-        best_path = path_low.copy()
-        best_path[original_place_name] = 0
-
-    # 6. Lưu cache
-    memo[node_id] = (best_score, best_path)
-    return best_score, best_path
-
-def complete_and_optimize_marking(partial_marking, places, weights):
+def find_optimal_marking(bdd_node, w_by_var, orig_name=None):
     """
-    Điền các biến thiếu (Don't care):
-    - Nếu weight > 0 -> điền 1 (để tăng max score)
-    - Nếu weight <= 0 -> điền 0
-    Cập nhật lại tổng giá trị tối ưu.
+    Tìm marking tối ưu trên BDD (Max Weight Path), kể cả các biến "Don't care".
+
+    Args:
+        bdd_node: BDD (VD: R từ build_reachability_bdd)
+        w_by_var: trọng số theo tên biến BDD, VD {'v0_p1': 3, ...}
+        orig_name: tên place gốc theo tên biến BDD (tính sẵn một lần);
+                   None -> tách bằng get_original_name
+
+    Returns:
+        (best_score, marking): marking là dict {place: 0/1} cho mọi biến
+        trong orig_name (hoặc w_by_var nếu orig_name là None)
+        (-inf, {} nếu BDD rỗng)
+
+    Hai pha, không đệ quy (không bị giới hạn recursion depth của Python):
+      1) DFS hậu thứ tự bằng stack: tính score tốt nhất và nhánh tốt nhất cho mỗi node.
+         Các level bị bỏ qua giữa một node và node con là Don't care, đóng góp
+         max(w, 0) mỗi biến -> cộng bằng prefix sum ngay trong DP.
+      2) Đi từ root theo nhánh tốt nhất để dựng marking, điền Don't care = (w > 0).
     """
-    full_marking = {}
-    extra_score = 0
-    
-    for p in places:
-        if p in partial_marking:
-            full_marking[p] = partial_marking[p]
+    NEG_INF = float('-inf')
+
+    bdd = bdd_node.bdd
+    num_levels = len(bdd.vars)
+    level_vars = [bdd.var_at_level(k) for k in range(num_levels)]
+
+    # pos_prefix[L] = sum(max(w, 0) của các biến ở level < L)
+    pos_prefix = [0] * (num_levels + 1)
+    for k, var in enumerate(level_vars):
+        pos_prefix[k + 1] = pos_prefix[k] + max(w_by_var.get(var, 0), 0)
+
+    def level_of(node):
+        # Node terminal nằm dưới mọi level biến
+        return num_levels if node.var is None else node.level
+
+    def gap(level, child_level):
+        # Tổng max(w, 0) của các level bị bỏ qua: level < k < child_level
+        return pos_prefix[child_level] - pos_prefix[level + 1]
+
+    # Một "trạng thái" là (node, parity): giá trị = parity XOR giá trị của node.
+    # dd dùng complemented edges; low/high là cofactor của node không bị phủ định,
+    # nên parity được cộng dồn dọc đường đi.
+    # Key = (int(node), parity): int(node) là handle của dd (không dùng id() vì có thể tái sử dụng)
+    score = {}   # key -> điểm tốt nhất từ trạng thái này tới True
+    choice = {}  # key -> (tên biến, bit chọn, key của con, level con)
+
+    root_key = (int(bdd_node), False)
+    stack = [(bdd_node, False, False)]  # (node, parity, đã push các con chưa)
+    while stack:
+        node, parity, expanded = stack.pop()
+        key = (int(node), parity)
+        if key in score:
+            continue
+
+        p = parity ^ node.negated
+        bdd_var = node.var  # VD: 'v0_p1'; None nếu là node terminal
+        if bdd_var is None:
+            # Terminal không phủ định là True: đích đến (0), ngược lại là dead end
+            score[key] = NEG_INF if p else 0
+            continue
+
+        low, high = node.low, node.high
+        low_key = (int(low), p)
+        high_key = (int(high), p)
+
+        if not expanded:
+            # Tính các con trước (hậu thứ tự)
+            stack.append((node, parity, True))
+            if high_key not in score:
+                stack.append((high, p, False))
+            if low_key not in score:
+                stack.append((low, p, False))
+            continue
+
+        level = node.level
+        low_level = level_of(low)
+        high_level = level_of(high)
+
+        # Nhánh Low (Place = 0): Không cộng trọng số
+        # Nhánh High (Place = 1): CỘNG trọng số
+        # Cả hai nhánh cộng thêm Don't care dương trên các level bị bỏ qua
+        score_low = score[low_key]
+        if score_low != NEG_INF:
+            score_low += gap(level, low_level)
+        score_high = score[high_key]
+        if score_high != NEG_INF:
+            score_high += w_by_var.get(bdd_var, 0) + gap(level, high_level)
+
+        if score_high >= score_low:
+            score[key] = score_high
+            choice[key] = (bdd_var, 1, high_key, high_level)
         else:
-            # Xử lý Don't care
-            w = weights.get(p, 0)
-            if w > 0:
-                full_marking[p] = 1
-                extra_score += w # Cộng thêm điểm vì ta chọn 1
-            else:
-                full_marking[p] = 0
-                # Không cộng điểm vì chọn 0
-                
-    return full_marking, extra_score
\ No newline at end of file
+            score[key] = score_low
+            choice[key] = (bdd_var, 0, low_key, low_level)
+
+    root_level = level_of(bdd_node)
+    best_score = score[root_key]
+    if best_score == NEG_INF:
+        return best_score, {}
+    # Các level phía trên root cũng là Don't care
+    best_score += pos_prefix[root_level]
+
+    def place_of(var):
+        # Chỉ các biến có trong orig_name (hoặc w_by_var) là place;
+        # các biến khác của manager (VD *_next) không thuộc marking
+        if orig_name is not None:
+            return orig_name.get(var)
+        if var in w_by_var:
+            return get_original_name(var)
+        return None
+
+    def fill_dont_care(start, end):
+        # Don't care: chọn 1 nếu trọng số dương để tăng score
+        for k in range(start, end):
+            place = place_of(level_vars[k])
+            if place is not None:
+                marking[place] = 1 if w_by_var.get(level_vars[k], 0) > 0 else 0
+
+    # Dựng marking từ root theo nhánh tốt nhất, một lượt duy nhất
+    marking = {}
+    fill_dont_care(0, root_level)
+    key = root_key
+    while key in choice:
+        var, bit, key, child_level = choice[key]
+        place = place_of(var)
+        if place is not None:
+            marking[place] = bit
+        fill_dont_care(bdd.level_of_var(var) + 1, child_level)
+    return best_score, marking
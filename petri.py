@@ -1,7 +1,12 @@
 # petri.py
-from dataclasses import dataclass
-from typing import List, Dict, Tuple
-import xml.etree.ElementTree as ET
+from dataclasses import dataclass, field
+from typing import List, Dict, Tuple, Optional
+try:
+    # lxml (libxml2, C) nhanh hơn; API iterparse tương thích với ElementTree
+    from lxml import etree as ET
+except ImportError:
+    import xml.etree.ElementTree as ET
+import numpy as np
 
 # Định nghĩa cấu trúc dữ liệu cho Transition
 @dataclass
@@ -10,6 +15,27 @@ class Transition:
     name: str
     pre_mask: int    # Bitmask đại diện cho input places (places cần token để kích hoạt)
     post_mask: int   # Bitmask đại diện cho output places (places nhận token sau kích hoạt)
+    # Cache (mask, chỉ số các bit) cho pre_indices/post_indices, tính lại khi mask đổi
+    _pre_cache: Tuple[int, Tuple[int, ...]] = field(
+        default=(0, ()), init=False, repr=False, compare=False
+    )
+    _post_cache: Tuple[int, Tuple[int, ...]] = field(
+        default=(0, ()), init=False, repr=False, compare=False
+    )
+
+    @property
+    def pre_indices(self) -> Tuple[int, ...]:
+        """Chỉ số các places trong pre_mask (luôn khớp với pre_mask)."""
+        if self._pre_cache[0] != self.pre_mask:
+            self._pre_cache = (self.pre_mask, tuple(set_bit_indices(self.pre_mask)))
+        return self._pre_cache[1]
+
+    @property
+    def post_indices(self) -> Tuple[int, ...]:
+        """Chỉ số các places trong post_mask (luôn khớp với post_mask)."""
+        if self._post_cache[0] != self.post_mask:
+            self._post_cache = (self.post_mask, tuple(set_bit_indices(self.post_mask)))
+        return self._post_cache[1]
 
 # Định nghĩa cấu trúc dữ liệu cho Petri Net
 @dataclass
@@ -18,64 +44,112 @@ class PetriNet:
     place_index: Dict[str, int]    # Ánh xạ từ place ID -> chỉ số (index)
     transitions: List[Transition]  # Danh sách các transitions
     initial: int                   # Marking ban đầu được biểu diễn dưới dạng bitmask
-
-def _lname(tag: str) -> str:
+    # Layout SoA của transitions (cùng thứ tự với transitions), dùng cho BFS vector hóa
+    # dtype uint64 nếu <= 64 places, ngược lại dtype object (Python int)
+    pre_mask_arr: Optional[np.ndarray] = field(default=None, repr=False)
+    post_mask_arr: Optional[np.ndarray] = field(default=None, repr=False)
+    tid_arr: Optional[np.ndarray] = field(default=None, repr=False)
+
+def set_bit_indices(mask: int) -> List[int]:
+    """Chỉ số các bit đang bật của mask, chỉ duyệt bit đã set (lsb trick)."""
+    indices = []
+    while mask:
+        lsb = mask & -mask
+        indices.append(lsb.bit_length() - 1)
+        mask ^= lsb
+    return indices
+
+def _lname(tag) -> str:
     """Hàm helper để lấy local name từ XML tag (bỏ qua namespace)
     Ví dụ: '{http://www.pnml.org}place' -> 'place'"""
+    if not isinstance(tag, str):
+        # lxml: comment / processing instruction có tag là hàm
+        return ""
     return tag.split('}')[-1]
 
-def parse_pnml(path: str) -> PetriNet:
-    """Parser chính để đọc file PNML và chuyển thành đối tượng PetriNet"""
-    
-    # Đọc và parse file XML
-    tree = ET.parse(path)
-    root = tree.getroot()
-
-    # 1) Tìm phần tử <net> trong file PNML
-    # Dùng generator expression để tìm phần tử net đầu tiên
-    net = next((e for e in root.iter() if _lname(e.tag) == "net"), None)
-    if net is None:
-        raise ValueError("PNML thiếu <net>.")
+def _child_text(elem, child_name: str) -> str:
+    """Text (đã strip) của <text> đầu tiên không rỗng bên trong con trực tiếp
+    <child_name> của elem, VD <initialMarking><text>1</text></initialMarking>.
+    Trả về "" nếu không có."""
+    for child in elem:
+        if _lname(child.tag) == child_name:
+            for c2 in child.iter():
+                if _lname(c2.tag) == "text":
+                    txt = (c2.text or "").strip()
+                    if txt:
+                        return txt
+    return ""
+
+def _free(elem) -> None:
+    """Giải phóng phần tử đã xử lý trong iterparse (và các anh em đứng trước với lxml)."""
+    elem.clear()
+    if hasattr(elem, "getprevious"):
+        parent = elem.getparent()
+        while elem.getprevious() is not None:
+            del parent[0]
 
-    # 2) Đọc tất cả places và transitions để xây dựng danh sách node
-    place_elems: Dict[str, ET.Element] = {}  # Lưu place elements theo ID
-    trans_elems: Dict[str, ET.Element] = {}  # Lưu transition elements theo ID
-    
-    # Duyệt qua tất cả các phần tử trong net
-    for e in net.iter():
+def parse_pnml(path: str) -> PetriNet:
+    """Parser chính để đọc file PNML và chuyển thành đối tượng PetriNet
+
+    Đọc file một lượt duy nhất bằng iterparse: mỗi place/transition/arc được
+    xử lý ngay khi đóng thẻ rồi giải phóng. Arcs được lưu tạm (chỉ là 3 chuỗi)
+    và gắn vào transitions sau khi đã biết toàn bộ places/transitions.
+    """
+    # Trạng thái của <net> đầu tiên: 0 = chưa gặp, 1 = đang ở trong, 2 = đã đóng
+    net_state = 0
+
+    # place ID -> initial marking, transition ID -> name, theo thứ tự xuất hiện
+    place_marks: Dict[str, int] = {}
+    trans_names: Dict[str, str] = {}
+    arcs: List[Tuple[str, str, str, int]] = []  # (arc id, source, target, weight)
+
+    # 1) + 2) Một lượt duyệt: tìm <net> đầu tiên, đọc places/transitions/arcs trong đó
+    for event, e in ET.iterparse(path, events=("start", "end")):
         ln = _lname(e.tag)
+        if event == "start":
+            if ln == "net" and net_state == 0:
+                net_state = 1
+            continue
+        if net_state != 1:
+            continue
+
         if ln == "place":
-            pid = e.attrib["id"]
-            place_elems[pid] = e
+            # Initial marking: đọc <initialMarking><text>, mặc định là 0 token
+            txt = _child_text(e, "initialMarking")
+            place_marks[e.attrib["id"]] = int(txt) if txt else 0
+            _free(e)
         elif ln == "transition":
+            # Mặc định dùng ID làm name, nhưng nếu có phần tử <name> thì dùng name đó
             tid = e.attrib["id"]
-            trans_elems[tid] = e
+            trans_names[tid] = _child_text(e, "name") or tid
+            _free(e)
+        elif ln == "arc":
+            # Đọc trọng số của arc (weight), mặc định là 1
+            txt = _child_text(e, "inscription")
+            weight = int(txt) if txt else 1
+            arcs.append((e.attrib.get("id", "(no-id)"), e.attrib["source"], e.attrib["target"], weight))
+            _free(e)
+        elif ln == "net":
+            net_state = 2
+
+    if net_state == 0:
+        raise ValueError("PNML thiếu <net>.")
 
     # Validation: kiểm tra có ít nhất một place và transition
-    if not place_elems:
+    if not place_marks:
         raise ValueError("Không tìm thấy place nào.")
-    if not trans_elems:
+    if not trans_names:
         raise ValueError("Không tìm thấy transition nào.")
 
     # 3) Chỉ số hóa places - gán mỗi place một index duy nhất
     # Ví dụ: ['p1', 'p2', 'p3'] -> {'p1': 0, 'p2': 1, 'p3': 2}
-    places = list(place_elems.keys())
+    places = list(place_marks.keys())
     place_index = {p: i for i, p in enumerate(places)}
 
     # 4) Xây dựng initial marking dưới dạng bitmask
     # Mỗi place được biểu diễn bằng 1 bit: 1 có token, 0 không có token
     initial = 0
-    for pid, pe in place_elems.items():
-        m = 0  # Mặc định là 0 token
-        for child in pe:
-            if _lname(child.tag) == "initialMarking":
-                # Tìm phần tử <text> bên trong initialMarking
-                for c2 in child.iter():
-                    if _lname(c2.tag) == "text":
-                        txt = (c2.text or "").strip()
-                        if txt:
-                            m = int(txt)  # Chuyển text thành số
-                        break
+    for pid, m in place_marks.items():
         # Kiểm tra Petri net 1-safe: mỗi place chỉ có 0 hoặc 1 token
         if m not in (0, 1):
             raise ValueError(f"Initial marking của place {pid} không phải 0/1 (1-safe).")
@@ -83,48 +157,23 @@ def parse_pnml(path: str) -> PetriNet:
             # Set bit tương ứng với place này trong bitmask
             initial |= (1 << place_index[pid])
 
-    # 5) Khởi tạo các Transition (chưa có pre_mask và post_mask)
-    transitions: Dict[str, Transition] = {}
-    for tid, te in trans_elems.items():
-        # Mặc định dùng ID làm name, nhưng nếu có phần tử <name> thì dùng name đó
-        name = tid
-        for child in te:
-            if _lname(child.tag) == "name":
-                for c2 in child.iter():
-                    if _lname(c2.tag) == "text" and (c2.text or "").strip():
-                        name = c2.text.strip()
-                        break
-        # Tạo transition với pre_mask và post_mask = 0 (sẽ được điền từ arcs)
-        transitions[tid] = Transition(id=tid, name=name, pre_mask=0, post_mask=0)
+    # 5) Khởi tạo các Transition (pre_mask và post_mask sẽ được điền từ arcs)
+    transitions: Dict[str, Transition] = {
+        tid: Transition(id=tid, name=name, pre_mask=0, post_mask=0)
+        for tid, name in trans_names.items()
+    }
 
     # 6) Xử lý arcs để xây dựng pre_mask và post_mask cho transitions
-    for e in net.iter():
-        if _lname(e.tag) != "arc": 
-            continue
-            
-        src = e.attrib["source"]  # ID của node nguồn
-        tgt = e.attrib["target"]  # ID của node đích
-
-        # Đọc trọng số của arc (weight), mặc định là 1
-        weight = 1
-        for child in e.iter():
-            if _lname(child.tag) == "inscription":
-                for c2 in child.iter():
-                    if _lname(c2.tag) == "text":
-                        txt = (c2.text or "").strip()
-                        if txt:
-                            weight = int(txt)
-                        break
-        
+    for arc_id, src, tgt, weight in arcs:
         # Kiểm tra weight = 1 (yêu cầu cho 1-safe Petri net)
         if weight != 1:
-            raise ValueError(f"Arc {e.attrib.get('id','(no-id)')} có weight={weight} (không hỗ trợ, 1-safe).")
+            raise ValueError(f"Arc {arc_id} có weight={weight} (không hỗ trợ, 1-safe).")
 
         # Xác định loại của source và target
-        is_src_place = src in place_elems
-        is_src_trans = src in trans_elems
-        is_tgt_place = tgt in place_elems
-        is_tgt_trans = tgt in trans_elems
+        is_src_place = src in place_index
+        is_src_trans = src in transitions
+        is_tgt_place = tgt in place_index
+        is_tgt_trans = tgt in transitions
 
         # Validation: kiểm tra nodes tồn tại
         if not (is_src_place or is_src_trans) or not (is_tgt_place or is_tgt_trans):
@@ -143,10 +192,17 @@ def parse_pnml(path: str) -> PetriNet:
             # Arc không hợp lệ: Place->Place hoặc Transition->Transition
             raise ValueError(f"Arc không hợp lệ (P->P hoặc T->T): {src} -> {tgt}")
 
+    # 7) Layout SoA: mảng pre_mask/post_mask/id của tất cả transitions
+    trans_list = list(transitions.values())
+    mask_dtype = np.uint64 if len(places) <= 64 else object
+
     # Trả về đối tượng PetriNet hoàn chỉnh
     return PetriNet(
         places=places,
         place_index=place_index,
-        transitions=list(transitions.values()),
+        transitions=trans_list,
         initial=initial,
+        pre_mask_arr=np.array([t.pre_mask for t in trans_list], dtype=mask_dtype),
+        post_mask_arr=np.array([t.post_mask for t in trans_list], dtype=mask_dtype),
+        tid_arr=np.array([t.id for t in trans_list], dtype=object),
     )
\ No newline at end of file
@@ -1,7 +1,14 @@
 # reachability.py
 from collections import deque
 from typing import Dict, Tuple, List, Iterable
-from petri import PetriNet, Transition
+import numpy as np
+from petri import PetriNet, Transition, set_bit_indices
+
+# Với ít transitions, chi phí gọi NumPy mỗi marking lớn hơn vòng lặp Python
+VECTORIZE_MIN_TRANSITIONS = 64
+# Chi phí nạp Numba/biên dịch JIT (~0.3-2 s) chỉ đáng khi có nhiều markings:
+# BFS Python/NumPy chạy trước, vượt quá ngần này markings mới chuyển sang Numba
+NUMBA_MIN_STATES = 1 << 16
 
 def is_enabled(M: int, t: Transition) -> bool:
     """Kiểm tra transition t có enabled tại marking M không
@@ -52,6 +59,16 @@ def bfs_reachability(net: PetriNet, keep_edges: bool = False):
         edges: list các cạnh (M1, transition_id, M2) nếu keep_edges=True
         pred: dictionary mapping marking -> (previous_marking, transition_id)
     """
+    # Net <= 64 places (mảng uint64) và không cần edges: nếu số markings vượt
+    # NUMBA_MIN_STATES thì bỏ BFS hiện tại, chạy lại bằng BFS biên dịch Numba
+    budget = (
+        NUMBA_MIN_STATES
+        if not keep_edges
+        and net.pre_mask_arr is not None
+        and net.pre_mask_arr.dtype == np.uint64
+        else None
+    )
+
     # Marking bắt đầu
     start = net.initial
     
@@ -65,8 +82,19 @@ def bfs_reachability(net: PetriNet, keep_edges: bool = False):
     edges: List[Tuple[int, str, int]] = []  # (from_marking, transition_id, to_marking)
     pred: Dict[int, Tuple[int, str]] = {}   # marking -> (previous_marking, transition_id)
 
+    # Nếu net có layout SoA (parse_pnml) và đủ nhiều transitions thì dùng bản vector hóa
+    if net.pre_mask_arr is not None and len(net.transitions) >= VECTORIZE_MIN_TRANSITIONS:
+        result = _bfs_vectorized(net, keep_edges, visited, q, edges, pred, budget)
+        return result if result is not None else (visited, edges, pred)
+
     # BFS loop
     while q:
+        if budget is not None and len(visited) > budget:
+            budget = None
+            result = _bfs_numba(net)
+            if result is not None:
+                return result
+
         # Lấy marking đầu queue
         M = q.popleft()
         
@@ -90,6 +118,93 @@ def bfs_reachability(net: PetriNet, keep_edges: bool = False):
 
     return visited, edges, pred
 
+def _bfs_numba(net: PetriNet):
+    """Gọi bfs_u64 rồi chuyển kết quả về (visited, edges, pred) như bfs_reachability.
+    Trả về None nếu không có Numba."""
+    # Import muộn: chỉ nạp Numba khi state space đủ lớn để đáng dùng
+    from reachability_nb import bfs_u64
+    if bfs_u64 is None:
+        return None
+
+    states, parent, via = bfs_u64(
+        net.pre_mask_arr, net.post_mask_arr, np.uint64(net.initial)
+    )
+    states = states.tolist()
+    tids = net.tid_arr.tolist()
+
+    visited = set(states)
+    pred: Dict[int, Tuple[int, str]] = {
+        states[k]: (states[p], tids[j])
+        for k, (p, j) in enumerate(zip(parent.tolist(), via.tolist()))
+        if k > 0
+    }
+    return visited, [], pred
+
+def _bfs_vectorized(net: PetriNet, keep_edges: bool, visited, q, edges, pred, budget=None):
+    """Vòng lặp BFS của bfs_reachability trên các mảng pre/post của net:
+    mỗi marking chỉ cần một phép toán vector để tìm mọi transition enabled
+    và mọi marking kế tiếp. Cập nhật trực tiếp visited/q/edges/pred.
+    Trả về kết quả của _bfs_numba nếu vượt budget markings, ngược lại None."""
+    pre = net.pre_mask_arr
+    post = net.post_mask_arr
+    tids = net.tid_arr.tolist()
+    # uint64 khi <= 64 places, object (Python int) khi lớn hơn
+    to_mask = pre.dtype.type if pre.dtype != object else int
+    not_pre = ~pre
+
+    while q:
+        if budget is not None and len(visited) > budget:
+            budget = None
+            result = _bfs_numba(net)
+            if result is not None:
+                return result
+
+        M = q.popleft()
+        Mv = to_mask(M)
+
+        # Chỉ số các transition enabled: M chứa toàn bộ pre_mask
+        en = np.flatnonzero((pre & Mv) == pre)
+        if en.size == 0:
+            continue
+
+        # Tất cả marking kế tiếp trong một phép toán: (M & ~pre) | post
+        # tolist() chuyển về Python int một lần cho cả mảng
+        succ = ((Mv & not_pre[en]) | post[en]).tolist()
+
+        # Duyệt theo thứ tự transition như bản tuần tự (cùng edges/pred)
+        for j, M2 in zip(en.tolist(), succ):
+            if keep_edges:
+                edges.append((M, tids[j], M2))
+            if M2 not in visited:
+                visited.add(M2)
+                pred[M2] = (M, tids[j])
+                q.append(M2)
+
+def reachable_invariants(visited: Iterable[int], num_places: int):
+    """Điều kiện cần thỏa bởi mọi marking trong visited (dùng cho Task 4)
+
+    Returns:
+        cardinality: (min_ones, max_ones) số token ít nhất/nhiều nhất
+        exclusive_pairs: các cặp place (i, j), i < j, không bao giờ cùng có token
+    """
+    min_ones, max_ones = num_places, 0
+    # co[i]: OR của mọi marking có token ở place i
+    co = [0] * num_places
+    for M in visited:
+        ones = set_bit_indices(M)
+        min_ones = min(min_ones, len(ones))
+        max_ones = max(max_ones, len(ones))
+        for i in ones:
+            co[i] |= M
+
+    exclusive_pairs = [
+        (i, j)
+        for i in range(num_places)
+        for j in range(i + 1, num_places)
+        if not (co[i] >> j) & 1
+    ]
+    return (min_ones, max_ones), exclusive_pairs
+
 def fmt_marking(M: int, place_names: List[str]) -> str:
     """Định dạng marking bitmask thành string dễ đọc
     
@@ -100,12 +215,13 @@ def fmt_marking(M: int, place_names: List[str]) -> str:
     Returns:
         String dạng {p1, p3, p5} chỉ các places có token
     """
-    # Tìm tất cả places có token
+    # Tìm tất cả places có token: chỉ duyệt các bit đã set
+    # (lsb = bit thấp nhất đang bật, xóa dần cho tới khi M = 0)
     bits = []
-    for i, p in enumerate(place_names):
-        # Kiểm tra bit thứ i có được set không
-        if M & (1 << i):
-            bits.append(p)
+    while M:
+        lsb = M & -M
+        bits.append(place_names[lsb.bit_length() - 1])
+        M ^= lsb
     
     # Trả về dạng {p1, p2, p3}
     return "{" + ", ".join(bits) + "}"
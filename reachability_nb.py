@@ -0,0 +1,94 @@
+# reachability_nb.py
+# BFS reachability biên dịch JIT bằng Numba cho net có <= 64 places
+# (mỗi marking vừa một uint64). Không có Numba thì bfs_u64 = None và
+# reachability.bfs_reachability dùng bản Python/NumPy.
+import numpy as np
+
+try:
+    from numba import njit
+except ImportError:  # không có numba
+    njit = None
+
+# Hằng số nhân (Fibonacci hashing) cho bảng băm open-addressing
+_HASH_MULT = np.uint64(0x9E3779B97F4A7C15)
+
+
+if njit is not None:
+
+    @njit(cache=True)
+    def _insert(table, states, M, idx):
+        """Thêm M (chưa có) vào bảng băm, lưu chỉ số idx + 1 (0 = ô trống)."""
+        mask = table.size - 1
+        h = np.int64((M * _HASH_MULT) >> np.uint64(32)) & mask
+        while table[h] != 0:
+            h = (h + 1) & mask
+        table[h] = idx + 1
+
+    @njit(cache=True)
+    def _contains(table, states, M):
+        mask = table.size - 1
+        h = np.int64((M * _HASH_MULT) >> np.uint64(32)) & mask
+        while table[h] != 0:
+            if states[table[h] - 1] == M:
+                return True
+            h = (h + 1) & mask
+        return False
+
+    @njit(cache=True)
+    def bfs_u64(pre, post, initial):
+        """BFS trên markings uint64.
+
+        Args:
+            pre, post: mảng uint64 pre_mask/post_mask của các transitions
+            initial: marking ban đầu (uint64)
+
+        Returns:
+            (states, parent, via): các marking theo thứ tự BFS; với k > 0,
+            states[k] được sinh từ states[parent[k]] bằng transition via[k]
+            (parent[0] = via[0] = -1).
+        """
+        cap = 1024
+        states = np.empty(cap, dtype=np.uint64)
+        parent = np.empty(cap, dtype=np.int64)
+        via = np.empty(cap, dtype=np.int64)
+        # Bảng băm luôn lớn gấp >= 2 lần số marking (load factor <= 0.5)
+        table = np.zeros(2 * cap, dtype=np.int64)
+
+        states[0] = initial
+        parent[0] = -1
+        via[0] = -1
+        _insert(table, states, initial, 0)
+        count = 1
+        head = 0  # states[head:count] chính là queue BFS
+
+        num_trans = pre.size
+        while head < count:
+            M = states[head]
+            for j in range(num_trans):
+                if (M & pre[j]) != pre[j]:
+                    continue
+                M2 = (M & ~pre[j]) | post[j]
+                if _contains(table, states, M2):
+                    continue
+
+                if count == states.size:
+                    # Tăng gấp đôi mảng và rehash
+                    new_cap = 2 * states.size
+                    states = np.concatenate((states, np.empty(states.size, dtype=np.uint64)))
+                    parent = np.concatenate((parent, np.empty(parent.size, dtype=np.int64)))
+                    via = np.concatenate((via, np.empty(via.size, dtype=np.int64)))
+                    table = np.zeros(2 * new_cap, dtype=np.int64)
+                    for k in range(count):
+                        _insert(table, states, states[k], k)
+
+                states[count] = M2
+                parent[count] = head
+                via[count] = j
+                _insert(table, states, M2, count)
+                count += 1
+            head += 1
+
+        return states[:count], parent[:count], via[:count]
+
+else:
+    bfs_u64 = None
@@ -1,8 +1,8 @@
 """Symbolic reachability using BDDs.
 
 This module builds a partitioned transition relation from a Petri net and
-computes the set of reachable markings using symbolic fixed-point
-iteration. It also exposes a BDD-based membership check for Task 4.
+computes the set of reachable markings using saturation-style symbolic
+fixed-point iteration. It also exposes a BDD-based membership check for Task 4.
 """
 
 from __future__ import annotations
@@ -11,7 +11,12 @@ import re
 import time
 from typing import Iterable, List, Tuple
 
-from dd.autoref import BDD
+try:
+    # CUDD (C backend): same API as dd.autoref, much faster apply/exist/let
+    from dd.cudd import BDD
+except ImportError:
+    from dd.autoref import BDD
+from optimization import find_optimal_marking
 from petri import PetriNet, parse_pnml
 
 
@@ -40,76 +45,80 @@ def build_reachability_bdd(net: PetriNet) -> Tuple[BDD, int, List[str]]:
         nxt = f"v{i}_{base}_next"
         bdd_vars.append((curr, nxt))
 
+    # Interleaved order [v0, v0_next, v1, v1_next, ...]: each curr/next
+    # pair sits on adjacent levels
     flat_vars = [v for pair in bdd_vars for v in pair]
     bdd.declare(*flat_vars)
 
-    rename_map = {nxt: bdd.var(curr) for curr, nxt in bdd_vars}
+    # Build initial state BDD as a single cube over current-state variables
+    R = bdd.cube(
+        {curr: bool((net.initial >> idx) & 1) for idx, (curr, _) in enumerate(bdd_vars)}
+    )
 
-    # Build initial state BDD explicitly
-    R = bdd.true
-    for idx, (curr, _) in enumerate(bdd_vars):
-        v = bdd.var(curr)
-        if (net.initial >> idx) & 1:
-            R = bdd.apply("and", R, v)
-        else:
-            R = bdd.apply("and", R, bdd.apply("not", v))
-
-    # Build per-transition relations
-    trans_bdds = []
+    # Build per-transition relations over the places t touches only.
+    # Untouched places keep their value implicitly: the image step
+    # quantifies and renames just the touched variables, so no x <-> x'
+    # frame clauses are needed and each support is local to t.
+    trans_rels = []
     for t in net.transitions:
-        enabled = bdd.true
-        for i, (curr, _) in enumerate(bdd_vars):
-            if (t.pre_mask >> i) & 1:
-                enabled = bdd.apply("and", enabled, bdd.var(curr))
-
-        relation = bdd.true
-        for i, (curr, nxt) in enumerate(bdd_vars):
-            is_pre = (t.pre_mask >> i) & 1
-            is_post = (t.post_mask >> i) & 1
-
-            x = bdd.var(curr)
-            xnext = bdd.var(nxt)
-
-            if is_pre and not is_post:
-                # 1 -> 0
-                clause = bdd.apply("and", x, bdd.apply("not", xnext))
-            elif not is_pre and is_post:
-                # 0 -> 1
-                clause = bdd.apply("and", bdd.apply("not", x), xnext)
-            elif is_pre and is_post:
-                # 1 -> 1
-                clause = bdd.apply("and", x, xnext)
-            else:
-                # unchanged: (x & x') OR (~x & ~x')
-                a = bdd.apply("and", x, xnext)
-                nota = bdd.apply("not", x)
-                notb = bdd.apply("not", xnext)
-                b = bdd.apply("and", nota, notb)
-                clause = bdd.apply("or", a, b)
-
-            relation = bdd.apply("and", relation, clause)
-
-        trans_bdds.append(bdd.apply("and", enabled, relation))
-
-    # Fixed-point: compute reachable states
-    curr_names: Iterable[str] = [curr for curr, _ in bdd_vars]
-    curr_name_set = set(curr_names)
-
-    while True:
-        R_next = bdd.false
-        for tr in trans_bdds:
-            inter = bdd.apply("and", R, tr)
-            if inter == bdd.false:
-                continue
-
-            img = bdd.exist(curr_name_set, inter)
-            img = bdd.let(rename_map, img)
-            R_next = bdd.apply("or", R_next, img)
-
-        R_new = bdd.apply("or", R, R_next)
+        # Places touched by t are fixed by one cube:
+        #   pre only: 1 -> 0, post only: 0 -> 1, pre and post: 1 -> 1
+        # (the pre part of the cube is the enabling condition)
+        touched = {}
+        for i in t.pre_indices:
+            curr, nxt = bdd_vars[i]
+            touched[curr] = True
+            touched[nxt] = False
+        for i in t.post_indices:
+            curr, nxt = bdd_vars[i]
+            touched[curr] = touched.get(curr, False)
+            touched[nxt] = True
+        relation = bdd.cube(touched)
+
+        # next -> curr for the touched places only
+        places = set(t.pre_indices) | set(t.post_indices)
+        qvars = {bdd_vars[i][0] for i in places}
+        rename = {bdd_vars[i][1]: bdd_vars[i][0] for i in places}
+        top = min((bdd.level_of_var(bdd_vars[i][0]) for i in places), default=-1)
+        trans_rels.append((top, relation, qvars, rename))
+
+    # After `exist` the touched current-state variables are gone, so swapping
+    # each curr/next pair renames next -> curr. dd.cudd's _swap is a true
+    # variable swap (Cudd_bddSwapVariables); `let` with a name map is a
+    # vector compose, used only on backends without _swap.
+    swap = getattr(bdd, "_swap", None)
+
+    def image(S, rel):
+        _, relation, qvars, rename = rel
+        inter = bdd.apply("and", S, relation)
+        if inter == bdd.false:
+            return bdd.false
+        img = bdd.exist(qvars, inter)
+        if swap is not None:
+            return swap(img, rename)
+        return bdd.let(rename, img)
+
+    # Fixed-point: compute reachable states by saturation.
+    # Group transitions by the top (smallest) level of the places they touch,
+    # ordered bottom-up: groups[0] only touches the lowest levels.
+    by_level = {}
+    for rel in trans_rels:
+        by_level.setdefault(rel[0], []).append(rel)
+    groups = [by_level[lvl] for lvl in sorted(by_level, reverse=True)]
+
+    # Saturation as an explicit loop (no Python recursion, so the depth does
+    # not grow with the number of groups): groups[0..k-1] are already closed
+    # when group k is fired; if k adds states, restart from group 0.
+    k = 0
+    while k < len(groups):
+        R_new = R
+        for rel in groups[k]:
+            R_new = bdd.apply("or", R_new, image(R_new, rel))
         if R_new == R:
-            break
-        R = R_new
+            k += 1
+        else:
+            R = R_new
+            k = 0
 
     # curr_vars: chỉ danh sách biến hiện tại, trùng thứ tự places
     curr_vars = [curr for curr, _ in bdd_vars]
@@ -125,14 +134,47 @@ def build_symbolic_reachability(net: PetriNet) -> int:
 def is_marking_reachable_bdd(
     M: int, bdd: BDD, R, curr_vars: Iterable[str]
 ) -> bool:
-    """Check if a bitmask marking M is in Reach(M0) using BDD."""
-    subst = {}
-    for i, var in enumerate(curr_vars):
-        bit = (M >> i) & 1
-        subst[var] = bdd.true if bit == 1 else bdd.false
-
-    node = bdd.let(subst, R)
-    return node == bdd.true
+    """Check if a bitmask marking M is in Reach(M0) using BDD.
+
+    M assigns every current-state variable, so membership is a single
+    top-down walk of R following low/high by the bits of M (no `let`).
+    `bdd` is unused by the walk and kept for call compatibility.
+    """
+    var_index = {v: i for i, v in enumerate(curr_vars)}
+    node = R
+    # low/high are cofactors of the regular (non-complemented) node,
+    # so track complemented edges along the path
+    negated = False
+    while True:
+        negated ^= node.negated
+        var = node.var
+        if var is None:
+            # regular terminal is TRUE
+            return not negated
+        node = node.high if (M >> var_index[var]) & 1 else node.low
+
+
+def reachable_invariants_bdd(
+    bdd: BDD, R, curr_vars: List[str]
+) -> Tuple[Tuple[int, int], List[Tuple[int, int]]]:
+    """Necessary conditions satisfied by every marking in R (for Task 4).
+
+    Returns:
+        cardinality: (min_ones, max_ones), the fewest/most tokens of any
+                     marking in R (one max-weight pass each, unit weights)
+        exclusive_pairs: place index pairs (i, j), i < j, never both marked
+    """
+    max_ones, _ = find_optimal_marking(R, {v: 1 for v in curr_vars})
+    neg_min_ones, _ = find_optimal_marking(R, {v: -1 for v in curr_vars})
+
+    exclusive_pairs = []
+    for i, vi in enumerate(curr_vars):
+        Ri = bdd.apply("and", R, bdd.var(vi))
+        for j in range(i + 1, len(curr_vars)):
+            if bdd.apply("and", Ri, bdd.var(curr_vars[j])) == bdd.false:
+                exclusive_pairs.append((i, j))
+
+    return (int(-neg_min_ones), int(max_ones)), exclusive_pairs
 
 
 def main() -> None: